@@ -2,17 +2,24 @@
 Chat API endpoints for multi-turn conversations
 """
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse
+from sse_starlette.sse import EventSourceResponse, ServerSentEvent
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, AsyncGenerator
+from typing import List, Optional, Dict, AsyncGenerator
 from datetime import datetime
-import json
 import asyncio
+import time
+import orjson
 
 from app.services.chat_service import ChatService
 from app.services.context_manager import ContextManager
 from app.core.config import settings
 
+# Max Claude chunks buffered per stream before the upstream read pauses
+STREAM_BUFFER_SIZE = 64
+# Seconds a full buffer may wait on the client before the stream is aborted
+STREAM_STALL_TIMEOUT = 30
+
 router = APIRouter()
 chat_service = ChatService()
 context_manager = ContextManager()
@@ -34,11 +41,15 @@ class Message(BaseModel):
         """Extract text content from either format"""
         if self.content:
             return self.content
-        if self.parts:
-            # Extract text from parts
-            text_parts = [part.text for part in self.parts if part.type == "text" and part.text]
-            return "".join(text_parts)
-        return ""
+        if not self.parts:
+            return ""
+        if len(self.parts) == 1:
+            # Common case: a single text part, no list/join needed
+            part = self.parts[0]
+            return part.text if part.type == "text" and part.text else ""
+        # Extract text from parts
+        text_parts = [part.text for part in self.parts if part.type == "text" and part.text]
+        return "".join(text_parts)
 
 
 class ChatRequest(BaseModel):
@@ -48,12 +59,6 @@ class ChatRequest(BaseModel):
     stream: bool = False
 
 
-class ChatResponse(BaseModel):
-    message: Message
-    conversation_id: str
-    usage: Optional[Dict[str, Any]] = None
-
-
 @router.post("/")
 async def chat(request: ChatRequest):
     """
@@ -82,49 +87,50 @@ async def chat(request: ChatRequest):
         
         # If streaming, return SSE stream
         if request.stream:
-            return StreamingResponse(
+            # EventSourceResponse sets the no-cache/no-buffering headers and
+            # sends keep-alive comments so proxies don't drop long generations
+            return EventSourceResponse(
                 stream_chat_response(
                     processed_messages=processed_messages,
                     language=request.language,
                     conversation_id=conversation_id,
                     last_user_message=messages_dict[-1] if messages_dict else None
                 ),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Conversation-Id": conversation_id,
-                    "X-Accel-Buffering": "no",  # Disable nginx buffering if present
-                }
+                headers={"X-Conversation-Id": conversation_id},
+                ping=15,
+                sep="\n",  # Frontend proxy splits frames on "\n\n"
+                # The default ping ignores `sep` and ends in CRLF, which the
+                # proxy would hold back until the next data frame
+                ping_message_factory=lambda: ServerSentEvent(comment="ping", sep="\n"),
             )
         
         # Non-streaming response
         response = await chat_service.generate_response(
             messages=processed_messages,
             language=request.language,
-            stream=False
+            conversation_id=conversation_id
         )
         
         # Store conversation state
-        last_message = {
-            "role": request.messages[-1].role,
-            "content": request.messages[-1].get_content()
-        }
         await context_manager.store_message(
             conversation_id=conversation_id,
-            message=last_message,
-            response=response
+            message=messages_dict[-1],
+            response=response,
+            language=request.language
         )
         
-        return ChatResponse(
-            message=Message(
-                role="assistant",
-                content=response["content"],
-                timestamp=datetime.now()
-            ),
-            conversation_id=conversation_id,
-            usage=response.get("usage")
-        )
+        # Return the response directly; building Message/ChatResponse models
+        # here would only re-validate content we just produced
+        return ORJSONResponse(content={
+            "message": {
+                "role": "assistant",
+                "content": response["content"],
+                "parts": None,
+                "timestamp": datetime.now()
+            },
+            "conversation_id": conversation_id,
+            "usage": response.get("usage")
+        })
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -135,42 +141,93 @@ async def stream_chat_response(
     language: Optional[str],
     conversation_id: str,
     last_user_message: Optional[Dict[str, str]]
-) -> AsyncGenerator[str, None]:
+) -> AsyncGenerator[Dict[str, str], None]:
     """
     Stream chat response as Server-Sent Events (SSE) in AI SDK v6 format.
     """
-    message_id = f"msg_{int(datetime.now().timestamp() * 1000)}"
-    full_content = ""
+    message_id = f"msg_{time.time_ns() // 1_000_000}"
+    parts: List[str] = []
+    
+    # Pre-encode the constant payloads; per-token work is just escaping the delta
+    text_start = orjson.dumps({"type": "text-start", "id": message_id}).decode()
+    text_end = orjson.dumps({"type": "text-end", "id": message_id}).decode()
+    delta_prefix = '{"type":"text-delta","id":' + orjson.dumps(message_id).decode() + ',"delta":'
+    
+    # Bounded queue between Claude and the client: when a slow client lets it
+    # fill up, the producer blocks on put() and stops reading upstream. The
+    # upstream call holds a shared slot, so a client that stops reading for
+    # STREAM_STALL_TIMEOUT aborts the stream rather than keeping it
+    queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=STREAM_BUFFER_SIZE)
+    
+    async def _produce():
+        put = queue.put
+        put_nowait = queue.put_nowait
+        stream = chat_service.stream_response(
+            messages=processed_messages,
+            language=language
+        )
+        try:
+            async for text in stream:
+                try:
+                    put_nowait(text)
+                except asyncio.QueueFull:
+                    try:
+                        await asyncio.wait_for(put(text), STREAM_STALL_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        raise RuntimeError("Client stopped reading the stream") from None
+        except Exception:
+            # Wake the consumer so it re-raises; the stream is failing, so
+            # drop a buffered chunk if that is what it takes to make room
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+            raise
+        finally:
+            # Close the upstream stream now, releasing its slot
+            await stream.aclose()
+        await queue.put(None)  # Signal completion
+    
+    producer = asyncio.create_task(_produce())
     
     try:
         # Send text-start event
-        yield f"data: {json.dumps({'type': 'text-start', 'id': message_id})}\n\n"
+        yield {"data": text_start}
         
-        # Stream response from Claude - yield chunks immediately
-        async for chunk in chat_service.stream_response(
-            messages=processed_messages,
-            language=language
-        ):
+        # Bind per-token lookups to locals for the hot loop
+        get = queue.get
+        append = parts.append
+        dumps = orjson.dumps
+        
+        # Stream response from Claude - yield chunks as they are queued
+        while (chunk := await get()) is not None:
             if chunk:
-                full_content += chunk
+                append(chunk)
                 # Send text-delta event - yield immediately without buffering
-                yield f"data: {json.dumps({'type': 'text-delta', 'id': message_id, 'delta': chunk})}\n\n"
+                yield {"data": delta_prefix + dumps(chunk).decode() + "}"}
+        
+        # Re-raise any upstream error
+        await producer
         
         # Send text-end event
-        yield f"data: {json.dumps({'type': 'text-end', 'id': message_id})}\n\n"
+        yield {"data": text_end}
         
         # Store conversation state after streaming completes
         if last_user_message:
             await context_manager.store_message(
                 conversation_id=conversation_id,
                 message=last_user_message,
-                response={"content": full_content}
+                response={"content": "".join(parts)},
+                language=language
             )
     
     except Exception as e:
         # Send error event
         error_msg = str(e)
-        yield f"data: {json.dumps({'type': 'error', 'id': message_id, 'errorText': error_msg})}\n\n"
+        yield {"data": orjson.dumps({"type": "error", "id": message_id, "errorText": error_msg}).decode()}
+    
+    finally:
+        # Client disconnected (CancelledError) or stream finished
+        producer.cancel()
 
 
 @router.get("/conversations/{conversation_id}")
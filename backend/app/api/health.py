@@ -2,19 +2,25 @@
 Health check endpoints
 """
 from fastapi import APIRouter
+from fastapi.responses import Response
+import orjson
 
 router = APIRouter()
 
+# Probe responses are static, so they are encoded once at import
+_HEALTHY_JSON = orjson.dumps({"status": "healthy"})
+_READY_JSON = orjson.dumps({"status": "ready"})
+
 
 @router.get("/")
 async def health_check():
     """Basic health check"""
-    return {"status": "healthy"}
+    return Response(content=_HEALTHY_JSON, media_type="application/json")
 
 
 @router.get("/ready")
 async def readiness_check():
     """Readiness check for dependencies"""
     # TODO: Add database and Redis checks
-    return {"status": "ready"}
+    return Response(content=_READY_JSON, media_type="application/json")
 
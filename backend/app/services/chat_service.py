@@ -1,12 +1,12 @@
 """
 Chat service for handling AI model interactions
 """
-from typing import List, Dict, Any, Optional
-from anthropic import Anthropic
-import json
+from typing import List, Dict, Any, Optional, Tuple
 
 from app.core.config import settings
+from app.services.clients import get_anthropic_client, get_http_client, get_upstream_slots
 from app.services.prompts import get_system_prompt
+from app.services.semantic_cache import SemanticCache
 
 
 class ChatService:
@@ -25,14 +25,77 @@ class ChatService:
         if len(api_key) < 20:
             raise ValueError(f"ANTHROPIC_API_KEY appears to be invalid (too short). Length: {len(api_key)}")
         
-        self.client = Anthropic(api_key=api_key)
+        self._openai_client = None
+        # Cap in-flight Claude calls to stay inside the account's rate limits;
+        # shared with summarization, which uses the same account
+        self._slots = get_upstream_slots()
         self.model = settings.DEFAULT_MODEL
+        self.fallback_model = settings.FALLBACK_MODEL
+        self.max_tokens = settings.MAX_TOKENS
+        self.temperature = settings.TEMPERATURE
+        self.semantic_cache = SemanticCache() if settings.SEMANTIC_CACHE_ENABLED else None
+    
+    @property
+    def aclient(self):
+        """Anthropic client, shared with the context manager (one connection pool per process)"""
+        return get_anthropic_client()
+    
+    def _get_openai_client(self):
+        """Lazily create the OpenAI fallback client on the shared connection pool"""
+        if self._openai_client is None:
+            from openai import AsyncOpenAI
+            self._openai_client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                http_client=get_http_client()
+            )
+        return self._openai_client
+    
+    def _build_anthropic_request(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Build the system blocks and messages for the Anthropic API
+        
+        Marks the system prompt and the stable history prefix (everything
+        before the final turn) with cache_control so Claude can reuse its
+        KV cache across turns instead of re-processing the same prefix.
+        Leading system-role messages (conversation summaries) are moved into
+        the system blocks, since the Messages API does not accept them.
+        """
+        system_blocks = [{
+            "type": "text",
+            "text": system_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }]
+        
+        # process_messages already emits plain role/content dicts, so they
+        # are passed through as-is; only the leading summary is moved
+        start = 0
+        while start < len(messages) and messages[start]["role"] == "system":
+            system_blocks.append({"type": "text", "text": messages[start]["content"]})
+            start += 1
+        formatted_messages = messages[start:]
+        
+        if len(formatted_messages) > 1:
+            prefix_end = formatted_messages[-2]
+            formatted_messages[-2] = {
+                "role": prefix_end["role"],
+                "content": [{
+                    "type": "text",
+                    "text": prefix_end["content"],
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            }
+        
+        return system_blocks, formatted_messages
     
     async def generate_response(
         self,
         messages: List[Dict[str, str]],
         language: Optional[str] = None,
-        stream: bool = False
+        conversation_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Generate a response using Claude
@@ -40,66 +103,64 @@ class ChatService:
         Args:
             messages: List of message dicts with 'role' and 'content'
             language: Optional programming language context
-            stream: Whether to stream the response
+            conversation_id: Scopes semantic cache entries for follow-up turns
         
         Returns:
             Dict with 'content' and 'usage' keys
         """
         # Get system prompt based on language
         system_prompt = get_system_prompt(language)
+        system_blocks, formatted_messages = self._build_anthropic_request(
+            system_prompt, messages
+        )
         
-        # Format messages for Anthropic API
-        formatted_messages = []
-        for msg in messages:
-            formatted_messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        # Serve near-duplicate prompts from the semantic cache. Only an opening
+        # question stands on its own and can be shared across conversations;
+        # follow-ups depend on their history, so they are scoped to it
+        cache_prompt = None
+        if self.semantic_cache and messages and messages[-1]["role"] == "user":
+            cache_prompt = messages[-1]["content"]
+            if len(messages) == 1:
+                cache_scope = "global"
+            elif conversation_id:
+                cache_scope = conversation_id
+            else:
+                cache_prompt = None
+        if cache_prompt:
+            hit = await self.semantic_cache.lookup(cache_prompt, language, scope=cache_scope)
+            if hit:
+                return {"content": hit.response, "usage": {"cached": True}}
         
         try:
-            if stream:
-                # Handle streaming response (synchronous Anthropic client)
-                response_text = ""
-                with self.client.messages.stream(
+            async with self._slots:
+                response = await self.aclient.messages.create(
                     model=self.model,
-                    max_tokens=settings.MAX_TOKENS,
-                    temperature=settings.TEMPERATURE,
-                    system=system_prompt,
-                    messages=formatted_messages
-                ) as stream:
-                    for text in stream.text_stream:
-                        response_text += text
-                
-                return {
-                    "content": response_text,
-                    "usage": None  # Usage not available for streaming
-                }
-            else:
-                # Non-streaming response (synchronous Anthropic client)
-                response = self.client.messages.create(
-                    model=self.model,
-                    max_tokens=settings.MAX_TOKENS,
-                    temperature=settings.TEMPERATURE,
-                    system=system_prompt,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    system=system_blocks,
                     messages=formatted_messages
                 )
-                
-                return {
-                    "content": response.content[0].text,
-                    "usage": {
-                        "input_tokens": response.usage.input_tokens,
-                        "output_tokens": response.usage.output_tokens
-                    }
-                }
         
         except Exception as e:
             # Fallback to OpenAI if configured and not a placeholder
             if settings.OPENAI_API_KEY and not settings.OPENAI_API_KEY.startswith('your_'):
                 return await self._fallback_to_openai(
-                    messages=formatted_messages,
+                    messages=messages,
                     system_prompt=system_prompt
                 )
             raise e
+        
+        content = response.content[0].text
+        if cache_prompt:
+            await self.semantic_cache.insert(cache_prompt, content, language, scope=cache_scope)
+        
+        return {
+            "content": content,
+            "usage": {
+                "input_tokens": response.usage.input_tokens,
+                "output_tokens": response.usage.output_tokens
+            }
+        }
     
     async def stream_response(
         self,
@@ -116,105 +177,83 @@ class ChatService:
         Yields:
             Text chunks as they arrive from Claude
         """
-        import asyncio
-        from queue import Queue, Empty
-        from threading import Thread
-        
         # Get system prompt based on language
         system_prompt = get_system_prompt(language)
+        system_blocks, formatted_messages = self._build_anthropic_request(
+            system_prompt, messages
+        )
         
-        # Format messages for Anthropic API
-        formatted_messages = []
-        for msg in messages:
-            formatted_messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-        
+        streamed_any = False
         try:
-            # Use a queue to bridge synchronous streaming to async generator
-            chunk_queue = Queue()
-            exception_queue = Queue()
-            stream_done = False
-            
-            def _stream_sync():
-                nonlocal stream_done
-                try:
-                    with self.client.messages.stream(
-                        model=self.model,
-                        max_tokens=settings.MAX_TOKENS,
-                        temperature=settings.TEMPERATURE,
-                        system=system_prompt,
-                        messages=formatted_messages
-                    ) as stream:
-                        for text in stream.text_stream:
-                            chunk_queue.put(text)
-                    stream_done = True
-                    chunk_queue.put(None)  # Signal completion
-                except Exception as e:
-                    exception_queue.put(e)
-                    stream_done = True
-                    chunk_queue.put(None)  # Signal completion
-            
-            # Start streaming in a separate thread
-            thread = Thread(target=_stream_sync, daemon=True)
-            thread.start()
-            
-            # Yield chunks as they arrive - use shorter timeout for more responsive streaming
-            while not stream_done or not chunk_queue.empty():
-                # Check for exceptions first
-                if not exception_queue.empty():
-                    raise exception_queue.get()
-                
-                # Get chunk from queue (with very short timeout for immediate yielding)
-                try:
-                    chunk = chunk_queue.get(timeout=0.01)  # 10ms timeout for faster response
-                    if chunk is None:  # Completion signal
-                        break
-                    yield chunk
-                except Empty:
-                    # No chunk available yet, yield control and check again
-                    await asyncio.sleep(0.001)  # Small sleep to yield control
-                    continue
+            # The slot is held for the whole stream
+            async with self._slots, self.aclient.messages.stream(
+                model=self.model,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                system=system_blocks,
+                messages=formatted_messages
+            ) as stream:
+                async for text in stream.text_stream:
+                    streamed_any = True
+                    yield text
         
         except Exception as e:
-            # Fallback to OpenAI if configured and not a placeholder
-            if settings.OPENAI_API_KEY and not settings.OPENAI_API_KEY.startswith('your_'):
-                # OpenAI streaming fallback would go here
-                raise e
+            # Fallback to OpenAI if configured and not a placeholder.
+            # Only safe before any Claude output reached the client.
+            if (
+                not streamed_any
+                and settings.OPENAI_API_KEY
+                and not settings.OPENAI_API_KEY.startswith('your_')
+            ):
+                async for text in self._stream_openai_fallback(
+                    messages=messages,
+                    system_prompt=system_prompt
+                ):
+                    yield text
+                return
             raise e
     
+    async def _stream_openai_fallback(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: str
+    ):
+        """Stream from OpenAI GPT-4 if Claude fails"""
+        client = self._get_openai_client()
+        
+        # Skip system role messages as we already have one
+        openai_messages = [{"role": "system", "content": system_prompt}]
+        openai_messages.extend(msg for msg in messages if msg["role"] != "system")
+        
+        stream = await client.chat.completions.create(
+            model=self.fallback_model,
+            messages=openai_messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
     async def _fallback_to_openai(
         self,
         messages: List[Dict[str, str]],
         system_prompt: str
     ) -> Dict[str, Any]:
         """Fallback to OpenAI GPT-4 if Claude fails"""
-        import asyncio
-        from openai import OpenAI
-        
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = self._get_openai_client()
         
-        # Convert messages format for OpenAI
+        # Skip system role messages as we already have one
         openai_messages = [{"role": "system", "content": system_prompt}]
-        for msg in messages:
-            # Skip system role messages as we already have one
-            if msg.get("role") != "system":
-                openai_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-        
-        # Run synchronous OpenAI call in thread pool
-        def _create_completion():
-            return client.chat.completions.create(
-                model=settings.FALLBACK_MODEL,
-                messages=openai_messages,
-                max_tokens=settings.MAX_TOKENS,
-                temperature=settings.TEMPERATURE
-            )
+        openai_messages.extend(msg for msg in messages if msg["role"] != "system")
         
-        response = await asyncio.to_thread(_create_completion)
+        response = await client.chat.completions.create(
+            model=self.fallback_model,
+            messages=openai_messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature
+        )
         
         return {
             "content": response.choices[0].message.content or "",
@@ -223,4 +262,3 @@ class ChatService:
                 "output_tokens": response.usage.completion_tokens
             }
         }
-
@@ -0,0 +1,71 @@
+"""
+Process-wide upstream clients shared by the chat and context services
+"""
+from typing import TYPE_CHECKING, Optional
+import asyncio
+import httpx
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from anthropic import AsyncAnthropic
+
+_http: Optional[httpx.AsyncClient] = None
+_anthropic: Optional["AsyncAnthropic"] = None
+_upstream_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Pooled HTTP client for all upstream LLM calls
+
+    One pool per process, so connections (and their TLS sessions) are
+    reused across requests and HTTP/2 streams are multiplexed over them.
+    """
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+        )
+    return _http
+
+
+def get_anthropic_client() -> "AsyncAnthropic":
+    """
+    Anthropic client on the shared connection pool
+
+    The SDK is imported on first use, so processes that never reach a chat
+    or summarization call don't pay for importing it.
+    """
+    global _anthropic
+    if _anthropic is None:
+        from anthropic import AsyncAnthropic
+        _anthropic = AsyncAnthropic(
+            api_key=settings.ANTHROPIC_API_KEY.strip(),
+            http_client=get_http_client()
+        )
+    return _anthropic
+
+
+def get_upstream_slots() -> asyncio.Semaphore:
+    """
+    Semaphore capping in-flight Claude calls per process
+
+    Chat, summarization and batch calls share one account rate limit, so
+    they all hold a slot for the duration of each API call.
+    """
+    global _upstream_slots
+    if _upstream_slots is None:
+        _upstream_slots = asyncio.Semaphore(settings.MAX_CONCURRENT_UPSTREAM)
+    return _upstream_slots
+
+
+async def aclose_clients():
+    """Close the shared connection pool"""
+    global _http, _anthropic
+    if _http is not None:
+        await _http.aclose()
+    _http = None
+    _anthropic = None
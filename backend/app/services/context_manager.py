@@ -1,23 +1,92 @@
 """
 Context manager for handling conversation history and summarization
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from itertools import islice
 from datetime import datetime
+import asyncio
+import hashlib
+import time
 import uuid
-import json
+
+from cachetools import TTLCache
+import orjson
 
 from app.core.config import settings
-from anthropic import Anthropic
+from app.services.conversation import (
+    Conversation,
+    ConversationSummary,
+    StoredMessage,
+    estimate_tokens
+)
+from app.services.clients import get_anthropic_client, get_upstream_slots
+from app.services.conversation_store import create_conversation_store
+from app.services.summary_batcher import SummaryBatcher
 
 
+# Static instructions for the summarization prompts, sent as a separate
+# cacheable content block ahead of the per-call conversation text
+_SUMMARY_PRESERVE = """- Key topics discussed
+- Important decisions or conclusions
+- Relevant code examples or patterns mentioned
+- User preferences or context"""
+_SUMMARY_INSTRUCTIONS = (
+    "Summarize the following conversation in a concise way, preserving:\n"
+    + _SUMMARY_PRESERVE
+)
+_UPDATE_INSTRUCTIONS = (
+    "Update the following conversation summary with the new messages, preserving:\n"
+    + _SUMMARY_PRESERVE
+)
+# Framing of the per-call block; the conversation lines go between head and tail
+_SUMMARY_HEAD_TMPL = "Language context: {language}\n\nConversation:"
+_UPDATE_HEAD_TMPL = "Language context: {language}\n\nCurrent summary:\n{summary}\n\nNew messages:"
+_SUMMARY_PROMPT_TAIL = "\nProvide a clear, concise summary:"
+_UPDATE_PROMPT_TAIL = "\nProvide the updated, concise summary:"
+# Messages store_message appends per turn (user message and response)
+_TURN_MESSAGES = 2
+
+def _verbatim_tail(tokens: List[int], ratio: float) -> int:
+    """
+    Number of most recent messages to keep verbatim when folding the rest
+    
+    Walks back from the newest message (always kept) while the tail fits
+    in `ratio` of the context budget less SUMMARY_MIN_DELTA_TOKENS, so the
+    next fold is worth its call, and stops at SUMMARIZATION_THRESHOLD messages.
+    """
+    budget = ratio * settings.CONTEXT_TOKEN_BUDGET - settings.SUMMARY_MIN_DELTA_TOKENS
+    kept = used = 0
+    for count in reversed(tokens):
+        if kept and (kept >= settings.SUMMARIZATION_THRESHOLD or used + count > budget):
+            break
+        kept += 1
+        used += count
+    return kept
+
 class ContextManager:
     """Manages conversation context and summarization"""
     
     def __init__(self):
-        self.client = Anthropic(api_key=settings.ANTHROPIC_API_KEY.strip())
-        # In-memory storage (replace with Redis/DB in production)
-        self.conversations: Dict[str, List[Dict[str, Any]]] = {}
-        self.summaries: Dict[str, str] = {}
+        # Redis when REDIS_URL is set, in-memory otherwise
+        self.store = create_conversation_store()
+        # Hot conversations, served after a cheap version check against the
+        # store so other workers' turns and summaries are never missed.
+        # Entries carry the conversation's summary, loaded with the messages
+        self._recent: TTLCache = TTLCache(
+            maxsize=settings.RECENT_CONVERSATIONS_CACHE_SIZE,
+            ttl=settings.RECENT_CONVERSATIONS_CACHE_TTL
+        )
+        # LRU of summaries keyed by (hash of previous summary and folded messages, language)
+        self._summary_cache: "OrderedDict[Tuple[bytes, str], str]" = OrderedDict()
+        # Background pre-summarization through the Message Batches API
+        self._batcher = SummaryBatcher() if settings.SUMMARY_BATCH_ENABLED else None
+        self._compacting: Dict[str, asyncio.Task] = {}
+    
+    @property
+    def client(self):
+        """Shared Anthropic client, created on first summarization"""
+        return get_anthropic_client()
     
     def create_conversation_id(self) -> str:
         """Generate a new conversation ID"""
@@ -32,138 +101,364 @@ class ContextManager:
         """
         Process messages and manage context length
         
-        If conversation is too long, summarize older messages
+        Messages already folded into the conversation summary are replaced by
+        it. When the rest (stored history plus the request's messages) exceeds
+        the token threshold, all but the most recent messages (as many as fit
+        the budget, see _verbatim_tail) are folded into the summary, unless
+        that would fold in fewer than SUMMARY_MIN_DELTA_TOKENS (not worth an
+        LLM call). Messages that
+        storing this turn would push out of the window are always folded in
+        first, so nothing leaves the window unsummarized.
+        
+        Earlier messages sent with the request (clients that resend the whole
+        history) are folded after the stored ones. They are never stored, so
+        that part of the summary is only cached, not persisted; the final
+        request message is always sent verbatim.
         """
         # Get existing conversation history
-        history = self.conversations.get(conversation_id, [])
-        
-        # Combine history with new messages
-        all_messages = history + [msg.dict() if hasattr(msg, 'dict') else msg for msg in messages]
-        
-        # Check if we need to summarize
-        # NOTE: When summarizing, old messages remain in self.conversations and are not deleted.
-        # This creates a memory leak - old messages accumulate indefinitely. The summary is only
-        # used for the API call, but full history stays in memory. In production, should either:
-        # 1. Replace old messages with summary in storage, or
-        # 2. Delete old messages after summarizing, or
-        # 3. Use Redis/DB with automatic cleanup/TTL
-        if len(all_messages) > settings.SUMMARIZATION_THRESHOLD:
-            # Summarize older messages
-            summary = await self._summarize_conversation(
-                messages=all_messages[:-len(messages)],  # All except the new ones
-                language=language
-            )
-            
-            # Store summary
-            self.summaries[conversation_id] = summary
-            
-            # Keep recent messages + summary
-            recent_messages = all_messages[-settings.SUMMARIZATION_THRESHOLD:]
-            
-            # Format for API: summary as system context + recent messages
-            processed = [
-                {
-                    "role": "system",
-                    "content": f"Previous conversation summary: {summary}"
-                }
-            ]
-            
-            for msg in recent_messages:
-                processed.append({
-                    "role": msg.get("role", "user"),
-                    "content": msg.get("content", "")
-                })
-            
-            return processed
-        
-        # If within limits, return all messages
-        return [
+        history = await self._load_history(conversation_id)
+        
+        new_messages = [msg.dict() if hasattr(msg, 'dict') else msg for msg in messages]
+        new_messages = [
             {
                 "role": msg.get("role", "user"),
                 "content": msg.get("content", "")
             }
-            for msg in all_messages
+            for msg in new_messages
         ]
+        
+        # Token pressure: messages not covered by the summary plus the new ones
+        start = history.unsummarized_start()
+        stored = len(history) - start
+        tokens = list(islice(history.tokens, start, None))
+        tokens.extend(estimate_tokens(msg["content"]) for msg in new_messages)
+        over_budget = sum(tokens) > settings.SUMMARIZATION_TOKEN_RATIO * settings.CONTEXT_TOKEN_BUDGET
+        
+        # Window messages the store will evict once this turn is appended
+        evicted = min(
+            max(len(history) + _TURN_MESSAGES - settings.MAX_CONVERSATION_LENGTH, 0),
+            len(history)
+        )
+        
+        # Pending messages to fold (stored ones first), keeping the most recent verbatim
+        fold = len(tokens) - _verbatim_tail(tokens, settings.SUMMARIZATION_TOKEN_RATIO)
+        if not over_budget and evicted <= start:
+            fold = 0
+        
+        summary = history.summary
+        stop = max(start + min(fold, stored), evicted)
+        if evicted > start or (
+            stop > start and sum(tokens[:fold]) >= settings.SUMMARY_MIN_DELTA_TOKENS
+        ):
+            summary = await self._fold_into_summary(
+                conversation_id,
+                history,
+                covered=history.first_seq + stop,
+                language=language
+            ) or summary
+        
+        # Then the request's earlier messages, once every stored message is covered
+        summary_text = summary.text if summary is not None else None
+        folded = 0
+        if fold > stored and (not history or summary is not None and summary.covered >= history.count):
+            summary_text, folded = await self._fold_request_messages(
+                new_messages[:fold - stored],
+                previous_summary=summary_text,
+                language=language,
+                min_tokens=0 if stop > start else settings.SUMMARY_MIN_DELTA_TOKENS
+            )
+        
+        # Format for API: summary as system context + messages it doesn't cover
+        processed = []
+        if summary_text is not None:
+            processed.append({
+                "role": "system",
+                "content": f"Previous conversation summary: {summary_text}"
+            })
+        start = min(max(summary.covered - history.first_seq, 0), len(history)) if summary else 0
+        processed.extend(history.api_messages(start))
+        processed.extend(new_messages[folded:])
+        
+        return processed
+    
+    async def _load_history(self, conversation_id: str) -> Conversation:
+        """
+        Get conversation history, serving hot conversations from the recent cache
+        
+        A cached window is only used while its message count and summary
+        coverage match the store's; with Redis, another worker may have
+        stored turns or a newer summary since it was cached.
+        """
+        history = self._recent.get(conversation_id)
+        if history is not None and history.version == await self.store.get_version(conversation_id):
+            return history
+        history = await self.store.load(conversation_id)
+        self._recent[conversation_id] = history
+        return history
+    
+    @staticmethod
+    def _hash_messages(messages: List[Dict[str, str]], previous_summary: Optional[str]) -> bytes:
+        """Stable digest of a previous summary and the role/content sequence folded into it"""
+        payload = orjson.dumps(
+            [previous_summary, [(msg["role"], msg["content"]) for msg in messages]]
+        )
+        return hashlib.blake2b(payload, digest_size=16).digest()
+    
+    def _cache_summary(self, key: Tuple[bytes, str], summary: str):
+        self._summary_cache[key] = summary
+        self._summary_cache.move_to_end(key)
+        if len(self._summary_cache) > settings.SUMMARY_CACHE_SIZE:
+            self._summary_cache.popitem(last=False)
+    
+    async def _fold_into_summary(
+        self,
+        conversation_id: str,
+        history: Conversation,
+        covered: int,
+        language: Optional[str] = None,
+        batch: bool = False
+    ) -> Optional[ConversationSummary]:
+        """
+        Fold the window's unsummarized messages before message number `covered` into the summary
+        
+        Only the messages after the previous summary's coverage are sent,
+        along with that summary. Returns the new summary, or None when there
+        was nothing to fold or summarization failed.
+        """
+        start = history.unsummarized_start()
+        stop = covered - history.first_seq
+        if stop <= start:
+            return None
+        
+        previous = history.summary
+        text = await self._summarize_conversation(
+            messages=history.api_messages(start, stop),
+            language=language,
+            previous_summary=previous.text if previous else None,
+            batch=batch
+        )
+        if text is None:
+            return None
+        
+        summary = ConversationSummary(text=text, covered=covered)
+        await self._save_summary(conversation_id, summary)
+        return summary
+    
+    async def _fold_request_messages(
+        self,
+        messages: List[Dict[str, str]],
+        previous_summary: Optional[str],
+        language: Optional[str] = None,
+        min_tokens: int = 0
+    ) -> Tuple[Optional[str], int]:
+        """
+        Fold unstored request messages into `previous_summary`
+        
+        Clients that resend the whole history grow it by a turn per request,
+        so summaries are cached under a running digest of each folded prefix
+        and only messages past the longest cached one are sent, in calls of
+        at most CONTEXT_TOKEN_BUDGET tokens. Nothing new is folded when that
+        is fewer than `min_tokens`. Returns the summary and how many of
+        `messages` it covers; on failure, as far as it got.
+        """
+        lang = language or ""
+        digests = []
+        digest = hashlib.blake2b(orjson.dumps(previous_summary), digest_size=16).digest()
+        for msg in messages:
+            digest = hashlib.blake2b(
+                digest + orjson.dumps((msg["role"], msg["content"])),
+                digest_size=16
+            ).digest()
+            digests.append(digest)
+        
+        # Resume from the longest prefix already folded
+        summary, folded = previous_summary, 0
+        for covered in range(len(messages), 0, -1):
+            key = (digests[covered - 1], lang)
+            cached = self._summary_cache.get(key)
+            if cached is not None:
+                self._summary_cache.move_to_end(key)
+                summary, folded = cached, covered
+                break
+        
+        tokens = [estimate_tokens(msg["content"]) for msg in messages]
+        if sum(tokens[folded:]) < max(min_tokens, 1):
+            return summary, folded
+        
+        while folded < len(messages):
+            stop, used = folded + 1, tokens[folded]
+            while stop < len(messages) and used + tokens[stop] <= settings.CONTEXT_TOKEN_BUDGET:
+                used += tokens[stop]
+                stop += 1
+            text = await self._summarize_conversation(
+                messages=messages[folded:stop],
+                language=language,
+                previous_summary=summary
+            )
+            if text is None:
+                break
+            summary, folded = text, stop
+            self._cache_summary((digests[stop - 1], lang), summary)
+        return summary, folded
+    
+    async def _save_summary(self, conversation_id: str, summary: ConversationSummary):
+        """Record a summary unless one covering as many messages already exists"""
+        # The store keeps the summary with the most coverage, so it survives
+        # restarts and is shared by every worker
+        if not await self.store.set_summary(conversation_id, summary):
+            return
+        cached = self._recent.get(conversation_id)
+        if cached is not None and (
+            cached.summary is None or cached.summary.covered < summary.covered
+        ):
+            cached.summary = summary
     
     async def _summarize_conversation(
         self,
-        messages: List[Dict[str, Any]],
-        language: Optional[str] = None
-    ) -> str:
+        messages: List[Dict[str, str]],
+        language: Optional[str] = None,
+        previous_summary: Optional[str] = None,
+        batch: bool = False
+    ) -> Optional[str]:
         """
-        Summarize a conversation to reduce context length
+        Summarize messages, updating `previous_summary` if given
         
-        Uses Claude to create a concise summary of the conversation
+        Uses Claude to create a concise summary of the conversation. Results
+        are cached by (previous summary, messages). With `batch`, the request
+        goes through the Message Batches API (cheaper, but only for
+        background work). Returns None if summarization fails.
         """
-        # Format messages for summarization
-        conversation_text = "\n".join([
-            f"{msg.get('role', 'user')}: {msg.get('content', '')}"
+        key = (self._hash_messages(messages, previous_summary), language or "")
+        cached = self._summary_cache.get(key)
+        if cached is not None:
+            self._summary_cache.move_to_end(key)
+            return cached
+        
+        # Only the small head is templated; the conversation lines go into the
+        # final join directly so their text is copied once
+        if previous_summary:
+            head = _UPDATE_HEAD_TMPL.format_map({
+                "language": language or "general",
+                "summary": previous_summary
+            })
+        else:
+            head = _SUMMARY_HEAD_TMPL.format_map({"language": language or "general"})
+        segments = [head]
+        segments.extend([
+            f"{msg['role']}: {msg['content']}"
             for msg in messages
         ])
+        segments.append(_UPDATE_PROMPT_TAIL if previous_summary else _SUMMARY_PROMPT_TAIL)
         
-        summary_prompt = f"""Summarize the following conversation in a concise way, preserving:
-- Key topics discussed
-- Important decisions or conclusions
-- Relevant code examples or patterns mentioned
-- User preferences or context
-
-Language context: {language or 'general'}
-
-Conversation:
-{conversation_text}
-
-Provide a clear, concise summary:"""
+        params = {
+            "model": settings.DEFAULT_MODEL,
+            "max_tokens": 500,
+            "temperature": 0.3,  # Lower temperature for more factual summaries
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": _UPDATE_INSTRUCTIONS if previous_summary else _SUMMARY_INSTRUCTIONS,
+                        "cache_control": {"type": "ephemeral"}
+                    },
+                    {"type": "text", "text": "\n".join(segments)}
+                ]
+            }]
+        }
         
         try:
-            # Anthropic client is synchronous
-            response = self.client.messages.create(
-                model=settings.DEFAULT_MODEL,
-                max_tokens=500,
-                temperature=0.3,  # Lower temperature for more factual summaries
-                messages=[{
-                    "role": "user",
-                    "content": summary_prompt
-                }]
-            )
-            
-            return response.content[0].text
+            if batch and self._batcher:
+                summary = await self._batcher.submit(params)
+            else:
+                async with get_upstream_slots():
+                    response = await self.client.messages.create(**params)
+                summary = response.content[0].text
+        
+        except Exception:
+            # Callers keep the previous summary and send the messages as they are
+            return None
         
-        except Exception as e:
-            # Fallback: simple truncation if summarization fails
-            return f"Previous conversation about {language or 'code'} ({len(messages)} messages)"
+        self._cache_summary(key, summary)
+        return summary
     
     async def store_message(
         self,
         conversation_id: str,
         message: Dict[str, Any],
-        response: Dict[str, Any]
+        response: Dict[str, Any],
+        language: Optional[str] = None
     ):
         """Store a message and response in conversation history"""
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = []
-        
-        # Store user message
-        self.conversations[conversation_id].append({
-            "role": "user",
-            "content": message.get("content", ""),
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Store assistant response
-        self.conversations[conversation_id].append({
-            "role": "assistant",
-            "content": response.get("content", ""),
-            "timestamp": datetime.now().isoformat()
-        })
+        user_content = message.get("content", "")
+        assistant_content = response.get("content", "")
+        # Epoch nanoseconds, taken once per turn; formatted only when rendered
+        now = time.time_ns()
+        new_messages = [
+            StoredMessage("user", user_content, now, estimate_tokens(user_content)),
+            StoredMessage("assistant", assistant_content, now, estimate_tokens(assistant_content))
+        ]
+        await self.store.append(conversation_id, new_messages)
+        
+        # Keep the recent cache in step with the store (same window); the
+        # conversation updates its own token total as messages are evicted
+        cached = self._recent.get(conversation_id)
+        if cached is not None:
+            cached.extend(new_messages)
+            self._maybe_compact(conversation_id, cached, language)
+    
+    def _maybe_compact(
+        self,
+        conversation_id: str,
+        history: Conversation,
+        language: Optional[str]
+    ):
+        """
+        Pre-summarize a conversation that is approaching the summarization threshold
+        
+        Runs in the background through the batch API and folds the messages
+        since the last summary (except the most recent ones) into it, so the
+        interactive path on a later turn has little or nothing left to fold.
+        Skipped until at least SUMMARY_MIN_DELTA_TOKENS are foldable, so a
+        conversation gets a batch every few turns rather than every turn.
+        """
+        if not self._batcher or conversation_id in self._compacting:
+            return
+        start = history.unsummarized_start()
+        budget = settings.SUMMARY_BATCH_TOKEN_RATIO * settings.CONTEXT_TOKEN_BUDGET
+        if history.tokens_between(start) <= budget:
+            return
+        
+        stop = len(history) - _verbatim_tail(
+            list(islice(history.tokens, start, None)),
+            settings.SUMMARY_BATCH_TOKEN_RATIO
+        )
+        if stop <= start or history.tokens_between(start, stop) < settings.SUMMARY_MIN_DELTA_TOKENS:
+            return
+        
+        task = asyncio.create_task(self._fold_into_summary(
+            conversation_id,
+            history,
+            covered=history.first_seq + stop,
+            language=language,
+            batch=True
+        ))
+        self._compacting[conversation_id] = task
+        task.add_done_callback(lambda _: self._compacting.pop(conversation_id, None))
+    
+    async def aclose(self):
+        """Release storage connections"""
+        await self.store.aclose()
     
     async def get_conversation(self, conversation_id: str) -> List[Dict[str, Any]]:
-        """Retrieve conversation history"""
-        return self.conversations.get(conversation_id, [])
+        """Retrieve conversation history, with timestamps rendered as ISO 8601"""
+        messages = (await self._load_history(conversation_id)).to_dicts()
+        for msg in messages:
+            if isinstance(msg["timestamp"], int):
+                msg["timestamp"] = datetime.fromtimestamp(msg["timestamp"] / 1e9).isoformat()
+        return messages
     
     async def delete_conversation(self, conversation_id: str):
         """Delete a conversation"""
-        if conversation_id in self.conversations:
-            del self.conversations[conversation_id]
-        if conversation_id in self.summaries:
-            del self.summaries[conversation_id]
-
+        self._recent.pop(conversation_id, None)
+        await self.store.delete(conversation_id)
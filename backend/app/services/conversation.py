@@ -0,0 +1,133 @@
+"""
+Compact in-process representation of a conversation's message window
+"""
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple, Union
+from collections import deque
+from itertools import islice
+
+import msgspec
+
+# Roles are stored as small ints rather than repeated strings
+ROLES = ("user", "assistant", "system")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)"""
+    return len(text) // 4
+
+
+class StoredMessage(msgspec.Struct, frozen=True):
+    """A message as persisted by the conversation stores"""
+    role: str
+    content: str
+    # Epoch nanoseconds (ISO strings in entries written by older versions)
+    timestamp: Union[int, str, None] = None
+    tokens: Optional[int] = None
+
+
+class ConversationSummary(msgspec.Struct, frozen=True):
+    """Rolling summary of the oldest messages of a conversation"""
+    text: str
+    # Number of messages folded in, counted from the start of the conversation
+    covered: int
+
+
+class Conversation:
+    """
+    Bounded message window stored as parallel arrays (structure of arrays)
+
+    Each message costs one slot in a few deques instead of a dict, and the
+    running token total is a single int kept in step with appends and
+    evictions, so threshold checks never rescan the messages. Dicts are
+    only rebuilt when formatting messages for the API or storage.
+
+    `count` is the number of messages stored over the conversation's
+    lifetime, so the oldest message in the window is number
+    `count - len(window)`. Summary coverage is tracked against these
+    numbers, which stay valid as the window slides.
+    """
+    __slots__ = ("roles", "contents", "timestamps", "tokens", "total_tokens", "count", "summary")
+
+    def __init__(
+        self,
+        maxlen: int,
+        messages: Iterable[StoredMessage] = (),
+        count: int = 0,
+        summary: Optional[ConversationSummary] = None
+    ):
+        self.roles: Deque[int] = deque(maxlen=maxlen)
+        self.contents: Deque[str] = deque(maxlen=maxlen)
+        self.timestamps: Deque[Any] = deque(maxlen=maxlen)
+        self.tokens: Deque[int] = deque(maxlen=maxlen)
+        self.total_tokens = 0
+        self.count = 0
+        self.extend(messages)
+        self.count = max(count, self.count)
+        self.summary = summary
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    @property
+    def first_seq(self) -> int:
+        """Number of the oldest message in the window"""
+        return self.count - len(self.contents)
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """(messages ever appended, messages covered by the summary), as the stores report it"""
+        return self.count, self.summary.covered if self.summary else 0
+
+    def unsummarized_start(self) -> int:
+        """Window index of the first message not folded into the summary"""
+        if self.summary is None:
+            return 0
+        return min(max(self.summary.covered - self.first_seq, 0), len(self.contents))
+
+    def tokens_between(self, start: int = 0, stop: Optional[int] = None) -> int:
+        """Token estimate of the window messages in [start, stop)"""
+        if start == 0 and stop is None:
+            return self.total_tokens
+        return sum(islice(self.tokens, start, stop))
+
+    def append(self, role: str, content: str, timestamp: Any = None, tokens: int = None):
+        """Append a message, evicting the oldest one when the window is full"""
+        if tokens is None:
+            tokens = estimate_tokens(content)
+        if len(self.tokens) == self.tokens.maxlen:
+            self.total_tokens -= self.tokens[0]
+        self.roles.append(ROLE_CODES.get(role, 0))
+        self.contents.append(content)
+        self.timestamps.append(timestamp)
+        self.tokens.append(tokens)
+        self.total_tokens += tokens
+        self.count += 1
+
+    def extend(self, messages: Iterable[StoredMessage]):
+        """Append stored messages"""
+        for msg in messages:
+            self.append(msg.role, msg.content, msg.timestamp, msg.tokens)
+
+    def api_messages(self, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, str]]:
+        """Window messages in [start, stop) as role/content dicts for the model APIs"""
+        return [
+            {"role": ROLES[role], "content": content}
+            for role, content in islice(zip(self.roles, self.contents), start, stop)
+        ]
+
+    def stored_messages(self) -> List[StoredMessage]:
+        """Messages in their stored form"""
+        return [
+            StoredMessage(ROLES[role], content, timestamp, tokens)
+            for role, content, timestamp, tokens in zip(
+                self.roles, self.contents, self.timestamps, self.tokens
+            )
+        ]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Messages as public dicts (the token estimates stay internal)"""
+        return [
+            {"role": ROLES[role], "content": content, "timestamp": timestamp}
+            for role, content, timestamp in zip(self.roles, self.contents, self.timestamps)
+        ]
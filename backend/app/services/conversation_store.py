@@ -0,0 +1,185 @@
+"""
+Conversation storage backends for the context manager
+"""
+from typing import List, Dict, Optional, Tuple
+import msgspec
+
+from app.core.config import settings
+from app.services.conversation import Conversation, ConversationSummary, StoredMessage
+
+# Replace the stored summary only with one that covers more messages, so a
+# slower summarization (e.g. a background batch) never rolls coverage back
+_SET_SUMMARY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if tonumber(redis.call('HGET', KEYS[1], 'covered') or '0') < tonumber(ARGV[1]) then
+    redis.call('HSET', KEYS[1], 'covered', ARGV[1], 'summary', ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class InMemoryConversationStore:
+    """Per-process storage; used when REDIS_URL is not configured"""
+
+    def __init__(self):
+        # Bounded windows (appends past the window evict the oldest messages),
+        # each carrying the conversation's latest summary
+        self.conversations: Dict[str, Conversation] = {}
+        self.window = settings.MAX_CONVERSATION_LENGTH
+
+    async def append(self, conversation_id: str, messages: List[StoredMessage]):
+        """Append messages to a conversation, keeping only the latest window"""
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            history = self.conversations[conversation_id] = Conversation(self.window)
+        history.extend(messages)
+
+    async def load(self, conversation_id: str) -> Conversation:
+        """Get a copy of a conversation's window"""
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            return Conversation(self.window)
+        return Conversation(
+            self.window,
+            history.stored_messages(),
+            count=history.count,
+            summary=history.summary
+        )
+
+    async def get_version(self, conversation_id: str) -> Tuple[int, int]:
+        """(messages ever appended, messages covered by the summary)"""
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            return 0, 0
+        return history.count, history.summary.covered if history.summary else 0
+
+    async def set_summary(self, conversation_id: str, summary: ConversationSummary) -> bool:
+        """Store a summary unless the stored one covers as many messages"""
+        history = self.conversations.get(conversation_id)
+        if history is None or (
+            history.summary is not None and history.summary.covered >= summary.covered
+        ):
+            return False
+        history.summary = summary
+        return True
+
+    async def get_summary(self, conversation_id: str) -> Optional[ConversationSummary]:
+        """Get the latest summary of a conversation"""
+        history = self.conversations.get(conversation_id)
+        return history.summary if history is not None else None
+
+    async def delete(self, conversation_id: str):
+        """Delete a conversation and its summary"""
+        self.conversations.pop(conversation_id, None)
+
+    async def aclose(self):
+        """Nothing to release"""
+
+
+class RedisConversationStore:
+    """
+    Redis-backed storage shared across workers
+
+    Key schema:
+        ctx:conv:{id}     List of JSON-encoded messages (msgspec StoredMessage)
+        ctx:meta:{id}     Hash; `count` is the number of messages ever appended,
+                          `summary` the latest summary and `covered` the
+                          number of messages folded into it
+
+    Both keys expire CONVERSATION_TTL_SECONDS after the last write, and the
+    list is trimmed to the latest MAX_CONVERSATION_LENGTH messages.
+    """
+
+    def __init__(self, redis_url: str):
+        import redis.asyncio as redis
+
+        self.pool = redis.ConnectionPool.from_url(
+            redis_url,
+            max_connections=settings.REDIS_MAX_CONNECTIONS
+        )
+        self.redis = redis.Redis(connection_pool=self.pool)
+        self.ttl = settings.CONVERSATION_TTL_SECONDS
+        self.window = settings.MAX_CONVERSATION_LENGTH
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder(StoredMessage)
+        self._set_summary_script = self.redis.register_script(_SET_SUMMARY_SCRIPT)
+
+    @staticmethod
+    def _conv_key(conversation_id: str) -> str:
+        return f"ctx:conv:{conversation_id}"
+
+    @staticmethod
+    def _meta_key(conversation_id: str) -> str:
+        return f"ctx:meta:{conversation_id}"
+
+    @staticmethod
+    def _summary(covered: Optional[bytes], text: Optional[bytes]) -> Optional[ConversationSummary]:
+        if covered is None or text is None:
+            return None
+        return ConversationSummary(text=text.decode(), covered=int(covered))
+
+    async def append(self, conversation_id: str, messages: List[StoredMessage]):
+        """Append messages to a conversation, trim it to the window and refresh its TTL"""
+        key = self._conv_key(conversation_id)
+        meta_key = self._meta_key(conversation_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(self._encoder.encode(msg) for msg in messages))
+            pipe.ltrim(key, -self.window, -1)
+            pipe.expire(key, self.ttl)
+            pipe.hincrby(meta_key, "count", len(messages))
+            pipe.expire(meta_key, self.ttl)
+            await pipe.execute()
+
+    async def load(self, conversation_id: str) -> Conversation:
+        """Get a conversation's window and summary"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(self._conv_key(conversation_id), 0, -1)
+            pipe.hmget(self._meta_key(conversation_id), "count", "covered", "summary")
+            raw, (count, covered, text) = await pipe.execute()
+        decode = self._decoder.decode
+        return Conversation(
+            self.window,
+            [decode(item) for item in raw],
+            count=int(count or 0),
+            summary=self._summary(covered, text)
+        )
+
+    async def get_version(self, conversation_id: str) -> Tuple[int, int]:
+        """(messages ever appended, messages covered by the summary); one small HMGET"""
+        count, covered = await self.redis.hmget(self._meta_key(conversation_id), "count", "covered")
+        return int(count or 0), int(covered or 0)
+
+    async def set_summary(self, conversation_id: str, summary: ConversationSummary) -> bool:
+        """Store a summary unless the stored one covers as many messages"""
+        stored = await self._set_summary_script(
+            keys=[self._meta_key(conversation_id)],
+            args=[summary.covered, summary.text, self.ttl]
+        )
+        return bool(stored)
+
+    async def get_summary(self, conversation_id: str) -> Optional[ConversationSummary]:
+        """Get the latest summary of a conversation"""
+        covered, text = await self.redis.hmget(self._meta_key(conversation_id), "covered", "summary")
+        return self._summary(covered, text)
+
+    async def delete(self, conversation_id: str):
+        """Delete a conversation and its summary"""
+        await self.redis.delete(
+            self._conv_key(conversation_id),
+            self._meta_key(conversation_id)
+        )
+
+    async def aclose(self):
+        """Release pooled connections"""
+        await self.pool.disconnect()
+
+
+def create_conversation_store():
+    """Use Redis when REDIS_URL is configured, otherwise keep state in-process"""
+    if settings.REDIS_URL:
+        return RedisConversationStore(settings.REDIS_URL)
+    return InMemoryConversationStore()
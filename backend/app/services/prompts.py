@@ -1,7 +1,8 @@
 """
 System prompts for different programming languages and contexts
 """
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Optional
 
 # Base system prompt
 BASE_SYSTEM_PROMPT = """You are DevDocs AI, an intelligent documentation assistant designed to help developers understand, document, and work with code across multiple programming languages.
@@ -79,25 +80,51 @@ LANGUAGE_PROMPTS = {
 }
 
 
+# Full prompts, concatenated once at import
+_COMPILED_PROMPTS: Dict[str, str] = {
+    lang_key: f"{BASE_SYSTEM_PROMPT}\n\n{lang_prompt}"
+    for lang_key, lang_prompt in LANGUAGE_PROMPTS.items()
+}
+
+# Common alternate spellings mapped to LANGUAGE_PROMPTS keys
+_ALIASES: Dict[str, str] = {
+    "py": "python",
+    "js": "javascript",
+    "node": "javascript",
+    "nodejs": "javascript",
+    "ts": "typescript",
+    "golang": "go",
+    "rs": "rust",
+    "c++": "cpp",
+    "cxx": "cpp",
+}
+
+
+@lru_cache(maxsize=64)
 def get_system_prompt(language: Optional[str] = None) -> str:
     """
     Get system prompt based on programming language context
     
+    Cached per language so every request reuses the same string, which
+    also keeps the system text byte-identical for prompt caching.
+    
     Args:
         language: Optional programming language identifier
     
     Returns:
         Complete system prompt string
     """
-    prompt = BASE_SYSTEM_PROMPT
+    if not language:
+        return BASE_SYSTEM_PROMPT
     
-    if language:
-        language_lower = language.lower()
-        # Check for exact match or partial match
-        for lang_key, lang_prompt in LANGUAGE_PROMPTS.items():
-            if lang_key in language_lower or language_lower in lang_key:
-                prompt += f"\n\n{LANGUAGE_PROMPTS[lang_key]}"
-                break
+    language_lower = language.lower()
+    key = _ALIASES.get(language_lower, language_lower)
+    if key in _COMPILED_PROMPTS:
+        return _COMPILED_PROMPTS[key]
     
-    return prompt
-
+    # Fall back to partial match for free-form identifiers
+    for lang_key in LANGUAGE_PROMPTS:
+        if lang_key in language_lower or language_lower in lang_key:
+            return _COMPILED_PROMPTS[lang_key]
+    
+    return BASE_SYSTEM_PROMPT
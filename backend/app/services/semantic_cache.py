@@ -0,0 +1,154 @@
+"""
+Semantic response cache for serving near-duplicate prompts without an LLM call
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import time
+
+from app.core.config import settings
+
+
+@dataclass
+class CacheHit:
+    """A cached response whose prompt matched the lookup above the threshold"""
+    response: str
+    similarity: float
+
+
+@dataclass
+class _Bucket:
+    """FAISS index plus payloads for a single (language, scope) key"""
+    index: Any = None
+    # id -> (response, expires_at); dicts keep insertion order, so the
+    # first key is always the oldest entry
+    entries: Dict[int, Tuple[str, float]] = field(default_factory=dict)
+    next_id: int = 0
+
+
+class SemanticCache:
+    """
+    In-memory semantic cache keyed by (language, conversation scope).
+
+    Prompts are embedded with sentence-transformers and stored in a FAISS
+    inner-product index over normalized vectors, so the search score is the
+    cosine similarity. Entries expire after a TTL, each bucket is capped
+    at ``max_entries`` (oldest evicted first) and at most ``max_buckets``
+    buckets are kept (least recently used dropped first), since
+    conversation-scoped buckets come and go with their conversations.
+    """
+
+    def __init__(
+        self,
+        model_name: str = settings.SEMANTIC_CACHE_MODEL,
+        ttl_seconds: int = settings.SEMANTIC_CACHE_TTL_SECONDS,
+        max_entries: int = settings.SEMANTIC_CACHE_MAX_ENTRIES,
+        max_buckets: int = settings.SEMANTIC_CACHE_MAX_BUCKETS,
+        threshold: float = settings.SEMANTIC_CACHE_THRESHOLD
+    ):
+        self.model_name = model_name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_buckets = max_buckets
+        self.threshold = threshold
+        self._model = None
+        self._buckets: "OrderedDict[Tuple[str, str], _Bucket]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def _get_model(self):
+        # Heavy imports are deferred until the cache is actually used
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def _embed(self, text: str):
+        return self._get_model().encode(
+            [text],
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype("float32")
+
+    def _new_bucket(self, dim: int) -> _Bucket:
+        import faiss
+        return _Bucket(index=faiss.IndexIDMap(faiss.IndexFlatIP(dim)))
+
+    def _evict(self, bucket: _Bucket, now: float):
+        """Drop expired entries and trim the bucket down to max_entries"""
+        import numpy as np
+
+        stale = [i for i, (_, expires_at) in bucket.entries.items() if expires_at <= now]
+        # Leave room for the entry about to be inserted
+        overflow = len(bucket.entries) - len(stale) - self.max_entries + 1
+        if overflow > 0:
+            expired = set(stale)
+            live = [i for i in bucket.entries if i not in expired]
+            stale.extend(live[:overflow])
+
+        if stale:
+            bucket.index.remove_ids(np.array(stale, dtype="int64"))
+            for i in stale:
+                del bucket.entries[i]
+
+    async def lookup(
+        self,
+        prompt: str,
+        language: Optional[str] = None,
+        threshold: Optional[float] = None,
+        scope: str = "global"
+    ) -> Optional[CacheHit]:
+        """Return the closest cached response if it clears the similarity threshold"""
+        key = (language or "", scope)
+        bucket = self._buckets.get(key)
+        if bucket is None or not bucket.entries:
+            return None
+        self._buckets.move_to_end(key)
+
+        # Embedding is CPU-bound; keep it off the event loop
+        vector = await asyncio.to_thread(self._embed, prompt)
+
+        async with self._lock:
+            scores, ids = bucket.index.search(vector, 1)
+            entry_id = int(ids[0][0])
+            similarity = float(scores[0][0])
+            entry = bucket.entries.get(entry_id)
+
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        if similarity < (self.threshold if threshold is None else threshold):
+            return None
+        return CacheHit(response=entry[0], similarity=similarity)
+
+    async def insert(
+        self,
+        prompt: str,
+        response: str,
+        language: Optional[str] = None,
+        scope: str = "global"
+    ):
+        """Cache a response for the given prompt"""
+        vector = await asyncio.to_thread(self._embed, prompt)
+        now = time.monotonic()
+        key = (language or "", scope)
+
+        async with self._lock:
+            import numpy as np
+
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = self._new_bucket(vector.shape[1])
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._evict(bucket, now)
+                self._buckets.move_to_end(key)
+
+            entry_id = bucket.next_id
+            bucket.next_id += 1
+            bucket.index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            bucket.entries[entry_id] = (response, now + self.ttl_seconds)
+
+    def clear(self):
+        """Drop every cached entry"""
+        self._buckets.clear()
@@ -0,0 +1,95 @@
+"""
+Coalesces background summarization requests into Anthropic Message Batches
+"""
+from typing import Any, Dict, List, Tuple
+import asyncio
+import uuid
+
+from app.core.config import settings
+from app.services.clients import get_anthropic_client, get_upstream_slots
+
+
+class SummaryBatcher:
+    """
+    Queues summarization requests and submits them as one Message Batch
+
+    Batches are billed at half price but can take minutes to complete, so
+    this is only for background work that nothing is waiting on
+    interactively. The worker flushes every BATCH_INTERVAL_MS or as soon as
+    SUMMARY_BATCH_SIZE jobs are queued, polls until the batch has ended and
+    resolves each job's future with its summary text.
+    """
+
+    def __init__(self):
+        self.batch_size = settings.SUMMARY_BATCH_SIZE
+        self.interval = settings.SUMMARY_BATCH_INTERVAL_MS / 1000
+        self.poll_interval = settings.SUMMARY_BATCH_POLL_SECONDS
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker = None
+        # Strong references so in-flight batch tasks aren't garbage collected
+        self._batches: set = set()
+
+    def submit(self, params: Dict[str, Any]) -> asyncio.Future:
+        """Queue a messages.create payload; the future resolves to the response text"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((params, future))
+        return future
+
+    async def _run(self):
+        while True:
+            jobs = [await self._queue.get()]
+            # Give concurrent jobs a moment to join the batch
+            deadline = asyncio.get_running_loop().time() + self.interval
+            while len(jobs) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    jobs.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Batches complete independently; keep collecting the next one
+            task = asyncio.create_task(self._process(jobs))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _process(self, jobs: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        futures = {}
+        requests = []
+        for params, future in jobs:
+            custom_id = uuid.uuid4().hex
+            futures[custom_id] = future
+            requests.append({"custom_id": custom_id, "params": params})
+
+        client = get_anthropic_client()
+        # Slots are held per API call, not while waiting between polls
+        slots = get_upstream_slots()
+        try:
+            async with slots:
+                batch = await client.messages.batches.create(requests=requests)
+            while batch.processing_status != "ended":
+                await asyncio.sleep(self.poll_interval)
+                async with slots:
+                    batch = await client.messages.batches.retrieve(batch.id)
+
+            async with slots:
+                async for entry in await client.messages.batches.results(batch.id):
+                    future = futures.pop(entry.custom_id, None)
+                    if future is None or future.done():
+                        continue
+                    if entry.result.type == "succeeded":
+                        future.set_result(entry.result.message.content[0].text)
+                    else:
+                        future.set_exception(RuntimeError(f"Batch request {entry.result.type}"))
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Requests missing from the results
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Batch request missing from results"))
@@ -3,23 +3,30 @@ FastAPI backend for DevDocs AI
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import orjson
 from dotenv import load_dotenv
-
-from app.api import chat, health
-from app.core.config import settings
 from pathlib import Path
 
-# Load .env file from backend directory
+# Load .env file from backend directory before settings are created.
+# Skipped when the environment already has the key (container env, or a
+# re-import under --reload), and never overrides existing variables
 env_path = Path(__file__).parent / ".env"
-load_dotenv(dotenv_path=env_path)
+if not os.getenv("ANTHROPIC_API_KEY"):
+    load_dotenv(dotenv_path=env_path, override=False)
+
+from app.api import chat, health
+from app.core.config import settings
+from app.services.clients import aclose_clients
 
 app = FastAPI(
     title="DevDocs AI API",
     description="Intelligent documentation assistant API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -36,11 +43,22 @@ app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Close upstream HTTP and storage connections"""
+    await chat.context_manager.aclose()
+    await aclose_clients()
+
+
+# Static body, encoded once; probes hitting / skip serialization entirely
+_ROOT_JSON = orjson.dumps({
+    "message": "DevDocs AI API",
+    "version": "1.0.0",
+    "status": "running"
+})
+
+
 @app.get("/")
 async def root():
-    return {
-        "message": "DevDocs AI API",
-        "version": "1.0.0",
-        "status": "running"
-    }
+    return Response(content=_ROOT_JSON, media_type="application/json")
 
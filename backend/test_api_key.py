@@ -20,27 +20,21 @@ print(f"   Path: {env_path}")
 print(f"   Exists: {env_path.exists()}")
 
 if env_path.exists():
-    with open(env_path, 'r') as f:
-        env_content = f.read()
-        if 'ANTHROPIC_API_KEY' in env_content:
-            # Extract the key line (without showing the full key)
-            key_line = [line for line in env_content.split('\n') if line.startswith('ANTHROPIC_API_KEY')]
-            if key_line:
-                key_parts = key_line[0].split('=')
-                if len(key_parts) > 1:
-                    key_value = key_parts[1].strip()
-                    print(f"   Key found: Yes")
-                    print(f"   Key length: {len(key_value)} characters")
-                    print(f"   Key starts with: {key_value[:20]}...")
-                    print(f"   Key ends with: ...{key_value[-10:]}")
-                    print(f"   Has whitespace: {key_value != key_value.strip()}")
-                    print(f"   Looks like placeholder: {key_value.startswith('your_') or 'placeholder' in key_value.lower()}")
-                else:
-                    print(f"   ⚠️  Key line found but no value after '='")
-            else:
-                print(f"   ❌ ANTHROPIC_API_KEY not found in .env")
+    from dotenv import dotenv_values
+    env_values = dotenv_values(env_path)
+    if 'ANTHROPIC_API_KEY' in env_values:
+        key_value = env_values['ANTHROPIC_API_KEY']
+        if key_value:
+            print(f"   Key found: Yes")
+            print(f"   Key length: {len(key_value)} characters")
+            print(f"   Key starts with: {key_value[:20]}...")
+            print(f"   Key ends with: ...{key_value[-10:]}")
+            print(f"   Has whitespace: {key_value != key_value.strip()}")
+            print(f"   Looks like placeholder: {key_value.startswith('your_') or 'placeholder' in key_value.lower()}")
         else:
-            print(f"   ❌ ANTHROPIC_API_KEY not in .env file")
+            print(f"   ⚠️  Key line found but no value after '='")
+    else:
+        print(f"   ❌ ANTHROPIC_API_KEY not in .env file")
 
 # 2. Try loading from settings
 print(f"\n2. Loading from app.core.config:")